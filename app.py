@@ -1,9 +1,8 @@
 import streamlit as st
 import os
-from google import genai
-from google.genai import types
-from PIL import Image
+import hashlib
 import io
+from collections import namedtuple
 
 # --- 页面基础配置 ---
 st.set_page_config(
@@ -12,6 +11,24 @@ st.set_page_config(
     layout="wide"
 )
 
+# --- 上传图片：内容哈希只算一次，作为后续所有缓存（缩略图、压缩图、Gemini 文件、生成结果）的统一键 ---
+Upload = namedtuple("Upload", "name mime bytes key")
+
+# --- 缓存预览缩略图：st.image 拿到原图也会解码缩放，按内容哈希缓存后 rerun 时不再重复 ---
+@st.cache_data(max_entries=32, show_spinner=False)
+def decode_thumbnail(key: str, _data: bytes, width: int = 150) -> bytes:
+    from PIL import Image, ImageOps
+
+    im = ImageOps.exif_transpose(Image.open(io.BytesIO(_data)))
+    im.thumbnail((width, width))
+    buf = io.BytesIO()
+    # 带透明通道的图保存为 PNG，其余保存为 JPEG
+    if im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info):
+        im.convert("RGBA").save(buf, "PNG")
+    else:
+        im.convert("RGB").save(buf, "JPEG", quality=80)
+    return buf.getvalue()
+
 # --- 侧边栏：设置与 API Key ---
 with st.sidebar:
     st.header("⚙️ 设置")
@@ -45,13 +62,29 @@ with col1:
         type=["jpg", "jpeg", "png", "webp"],
         accept_multiple_files=True # 允许上传多张
     )
+
+    # 每个文件只读取、哈希一次，按上传的 file_id 存在 session_state 里，rerun 时直接复用
+    ss = st.session_state
+    ss.setdefault("img_cache", {})
+    for f in uploaded_files or []:
+        if f.file_id not in ss.img_cache:
+            data = f.getvalue()
+            key = hashlib.blake2b(data, digest_size=16).hexdigest()
+            ss.img_cache[f.file_id] = Upload(f.name, f.type, data, key)
+    # 移除已被用户删掉的文件，避免会话内存一直增长
+    current_ids = {f.file_id for f in uploaded_files or []}
+    for file_id in list(ss.img_cache):
+        if file_id not in current_ids:
+            del ss.img_cache[file_id]
+
+    uploads = [ss.img_cache[f.file_id] for f in uploaded_files or []]
     
     # 显示图片预览（缩略图模式）
-    if uploaded_files:
-        st.caption(f"已上传 {len(uploaded_files)} 张图片")
-        # 将上传的文件转为 Image 对象用于预览
-        preview_images = [Image.open(f) for f in uploaded_files]
-        st.image(preview_images, width=150, caption=[f.name for f in uploaded_files])
+    if uploads:
+        st.caption(f"已上传 {len(uploads)} 张图片")
+        # 生成缩略图用于预览（按内容哈希缓存）
+        preview_images = [decode_thumbnail(u.key, u.bytes) for u in uploads]
+        st.image(preview_images, width=150, caption=[u.name for u in uploads])
 
     # 选项配置
     target_country = st.selectbox(
@@ -65,98 +98,47 @@ with col1:
         placeholder="例如：追求性价比的宝妈 / 独居大学生"
     )
 
-    generate_btn = st.button("🚀 开始生成 Listing", type="primary", use_container_width=True)
-
 # --- 核心逻辑 ---
-with col2:
+# 生成区放在 fragment 中：点击生成按钮时只重跑这一部分，左侧上传与预览不重建
+@st.fragment
+def generate_panel(uploads, target_country, target_audience, api_key):
     st.subheader("2. 生成结果")
 
+    generate_btn = st.button("🚀 开始生成 Listing", type="primary", use_container_width=True)
+
     if generate_btn:
+        # 首次点击生成时才导入 google.genai / PIL，缩短页面冷启动时间
+        import shopee_core as core
+
         if not api_key:
             st.error("❌ 请先配置 API Key")
-            st.stop()
+            return
         
-        if not uploaded_files:
+        if not uploads:
             st.warning("⚠️ 请至少上传一张图片！")
-            st.stop()
-
-        status_box = st.status("正在进行 AI 深度思考...", expanded=True)
+            return
+
+        # 输入完全相同则直接回放上次的结果，不再调用 Gemini
+        cache_key = core.listing_cache_key(uploads, target_country, target_audience)
+        cached_response = core.get_cached_response(cache_key)
+        if cached_response is not None:
+            st.markdown(cached_response)
+            return
+
+        status_box = st.status(
+            f"正在分析 {len(uploads)} 张产品图 · 联网检索 {target_country} 市场...",
+            expanded=True
+        )
         
         try:
-            client = genai.Client(api_key=api_key)
-            
-            # --- 升级点：处理多张图片 ---
-            # 创建一个列表，用来存放所有的内容部分（图片+文字）
-            content_parts = []
-            
-            # 1. 循环把所有图片加入到请求中
-            for img_file in uploaded_files:
-                # 指针归零，防止读取错误
-                img_file.seek(0)
-                image_bytes = img_file.getvalue()
-                content_parts.append(
-                    types.Part.from_bytes(data=image_bytes, mime_type=img_file.type)
-                )
-            
-            # 2. 加入提示词
-            user_prompt = f"""
-            这是我的产品图片（共 {len(uploaded_files)} 张，展示了不同角度/细节）。
-            目标站点：【{target_country}】
-            目标受众：【{target_audience if target_audience else "通用受众"}】
-            
-            请严格按照 System Instruction 的流程进行：
-            1. 视觉诊断 (综合分析所有图片细节)
-            2. 联网搜索痛点 (必须使用 Google Search)
-            3. 撰写 Listing
-            """
-            content_parts.append(types.Part.from_text(text=user_prompt))
-
-            # 3. 配置与调用
-            status_box.write(f"正在分析 {len(uploaded_files)} 张产品图...")
-            status_box.write(f"正在联网检索 {target_country} 市场...")
-            
-            response_placeholder = st.empty()
-            full_response = ""
-
-            # 调用模型
-            response = client.models.generate_content_stream(
-              model="gemini-1.5-flash",
-                contents=[
-                    types.Content(
-                        role="user",
-                        parts=content_parts # 这里放入了多张图片+文字
-                    )
-                ],
-                config=types.GenerateContentConfig(
-                    tools=[types.Tool(google_search=types.GoogleSearch())],
-                    system_instruction="""
-                    角色设定：
-                    你是一位拥有10年经验的Shopee跨境电商运营专家。
-
-                    核心任务：
-                    用户会上传一款产品的多张图片（正面、背面、细节等）。请综合所有图片信息，执行：
-
-                    1. 【视觉诊断】：
-                       - 整合多张图片信息，识别材质、功能、接口细节、包装配件。
-                       - 准确判断产品核心卖点。
-
-                    2. 【痛点挖掘（Google Search）】：
-                       - 搜索目标国家该品类的真实用户差评和气候/文化痛点。
-
-                    3. 【Listing 生成】：
-                       - 撰写标题（包含热搜词）。
-                       - 撰写五点描述（针对痛点提出解决方案）。
-                    """
-                )
+            listing_stream = core.generate_listing(
+                api_key, uploads, target_country, target_audience,
+                on_retry=lambda delay: status_box.write(f"⏳ 请求受限或服务繁忙，{delay} 秒后重试...")
             )
 
             # 流式输出
-            for chunk in response:
-                if chunk.text:
-                    full_response += chunk.text
-                    response_placeholder.markdown(full_response + "▌")
-            
-            response_placeholder.markdown(full_response)
+            full_response = st.write_stream(listing_stream)
+            core.put_cached_response(cache_key, full_response)
             status_box.update(label="✅ 生成完成！", state="complete", expanded=False)
 
         except Exception as e:
@@ -164,3 +146,5 @@ with col2:
             st.error(f"运行出错: {str(e)}")
 
 
+with col2:
+    generate_panel(uploads, target_country, target_audience, api_key)
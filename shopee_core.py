@@ -0,0 +1,244 @@
+# --- Shopee Listing 生成核心逻辑：模型配置、缓存、图片处理与流式调用（与界面无关） ---
+import streamlit as st
+import httpx
+from google import genai
+from google.genai import types
+from google.genai import errors
+import io
+import threading
+import time
+import random
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# --- 模型配置（固定不变，模块加载时构建一次） ---
+MODEL = "gemini-1.5-flash"
+
+SYSTEM_INSTRUCTION = """
+角色设定：
+你是一位拥有10年经验的Shopee跨境电商运营专家。
+
+核心任务：
+用户会上传一款产品的多张图片（正面、背面、细节等）。请综合所有图片信息，执行：
+
+1. 【视觉诊断】：
+   - 整合多张图片信息，识别材质、功能、接口细节、包装配件。
+   - 准确判断产品核心卖点。
+
+2. 【痛点挖掘（Google Search）】：
+   - 搜索目标国家该品类的真实用户差评和气候/文化痛点。
+
+3. 【Listing 生成】：
+   - 撰写标题（包含热搜词）。
+   - 撰写五点描述（针对痛点提出解决方案）。
+"""
+
+TOOLS = [types.Tool(google_search=types.GoogleSearch())]
+
+GENERATE_CONFIG = types.GenerateContentConfig(
+    tools=TOOLS,
+    system_instruction=SYSTEM_INSTRUCTION
+)
+
+# --- 缓存 Gemini 客户端：避免每次 rerun 重建连接池 ---
+# 同步客户端（httpx）使用 HTTP/2 并延长 keep-alive，流式响应复用同一条连接。
+# 这些参数只对 httpx 有效，不要传给 async_client_args（client.aio 可能走 aiohttp）
+REQUEST_TIMEOUT_MS = 120_000
+
+@st.cache_resource
+def get_client(api_key: str):
+    return genai.Client(
+        api_key=api_key,
+        http_options=types.HttpOptions(
+            timeout=REQUEST_TIMEOUT_MS,
+            client_args={"http2": True, "limits": httpx.Limits(keepalive_expiry=60)}
+        )
+    )
+
+# --- 限流（429）或服务端错误（5xx）时指数退避重试 ---
+# 第 n 次重试等待约 RETRY_BASE_DELAY * 2^n 秒（最多约 16 秒），并加随机抖动，
+# 避免线程池里同时失败的上传一起重试
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 2
+
+def is_retryable(e: errors.APIError) -> bool:
+    return e.code == 429 or (e.code or 0) >= 500
+
+# fn 不带参数，每次重试都会重新调用：请求用到的流、迭代器等要在 fn 内部新建，
+# 不能在外面建好后传进来复用（上一次失败时可能已被读完）
+def call_with_retry(fn, on_retry=None):
+    for attempt in range(MAX_RETRIES):
+        try:
+            return fn()
+        except errors.APIError as e:
+            if not is_retryable(e) or attempt == MAX_RETRIES - 1:
+                raise
+            delay = round(RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1), 1)
+            if on_retry:
+                on_retry(delay)
+            time.sleep(delay)
+
+# --- 通过 Files API 上传图片：相同图片只上传一次，请求里只引用 URI ---
+# Gemini 上传的文件保留 48 小时，缓存时间略短于此
+@st.cache_data(ttl=47 * 3600, show_spinner=False)
+def upload_image(api_key: str, key: str, _data: bytes, mime_type: str) -> str:
+    client = get_client(api_key)
+    # 每次重试都新建 BytesIO：SDK 会从当前位置读取整个流，失败重试时必须从头开始
+    file_ref = call_with_retry(
+        lambda: client.files.upload(
+            file=io.BytesIO(_data), config={"mime_type": mime_type}
+        )
+    )
+    return file_ref.uri
+
+# --- 上传前压缩图片：长边缩到 1024px 并转为 JPEG，减少视觉 token ---
+MAX_IMAGE_SIDE = 1024
+
+@st.cache_data(max_entries=64, ttl=47 * 3600, show_spinner=False)
+def normalize_image(key: str, _data: bytes) -> tuple[bytes, str]:
+    from PIL import Image, ImageOps
+
+    # 按 EXIF 方向转正（手机竖拍的照片），保存 JPEG 时 EXIF 会丢失
+    im = ImageOps.exif_transpose(Image.open(io.BytesIO(_data)))
+    im.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    # 透明背景的抠图铺白底，直接转 RGB 会变成黑底
+    if im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info):
+        im = im.convert("RGBA")
+        background = Image.new("RGB", im.size, (255, 255, 255))
+        background.paste(im, mask=im.getchannel("A"))
+        im = background
+    out = io.BytesIO()
+    im.convert("RGB").save(out, "JPEG", quality=85, optimize=True)
+    return out.getvalue(), "image/jpeg"
+
+# --- 缓存完整生成结果：相同图片+站点+受众重复提交时直接回放 ---
+RESPONSE_TTL = 3600
+RESPONSE_MAX_ENTRIES = 50
+
+# 所有会话共用同一份缓存，读写都要持锁
+@st.cache_resource
+def response_cache() -> tuple[OrderedDict, threading.Lock]:
+    return OrderedDict(), threading.Lock()
+
+def get_cached_response(key: str):
+    cache, lock = response_cache()
+    with lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        created, text = entry
+        if time.monotonic() - created > RESPONSE_TTL:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return text
+
+def put_cached_response(key: str, text):
+    # 模型没有返回文字（安全拦截、只有工具调用等）时 write_stream 返回的不是
+    # 非空字符串，这种结果不缓存，下次提交会重新请求
+    if not isinstance(text, str) or not text:
+        return
+    cache, lock = response_cache()
+    with lock:
+        cache[key] = (time.monotonic(), text)
+        cache.move_to_end(key)
+        while len(cache) > RESPONSE_MAX_ENTRIES:
+            cache.popitem(last=False)
+
+# --- 流式输出：合并多个 chunk 后再交给 st.write_stream，减少前端重绘 ---
+FLUSH_SECONDS = 0.025
+FLUSH_CHARS = 64
+
+def stream_text(response):
+    parts: list[str] = []
+    append = parts.append
+    size = 0
+    last_flush = time.monotonic()
+    for chunk in response:
+        text = chunk.text
+        if not text:
+            continue
+        append(text)
+        size += len(text)
+        now = time.monotonic()
+        if size >= FLUSH_CHARS or now - last_flush >= FLUSH_SECONDS:
+            yield "".join(parts)
+            parts.clear()
+            size = 0
+            last_flush = now
+    if parts:
+        yield "".join(parts)
+
+# --- 流式调用：只对建立流（拿到第一个 chunk）做重试，已输出内容后不再重发请求 ---
+_DONE = object()
+
+def stream_chunks(client, contents, config, on_retry=None):
+    def start():
+        response = iter(client.models.generate_content_stream(
+            model=MODEL,
+            contents=contents,
+            config=config
+        ))
+        return response, next(response, _DONE)
+
+    response, first = call_with_retry(start, on_retry=on_retry)
+    if first is _DONE:
+        return
+    yield first
+    yield from response
+
+# --- 结果缓存键：图片内容 + 站点 + 受众 + 模型配置 ---
+def listing_cache_key(uploads, target_country, target_audience) -> str:
+    return hashlib.blake2b(
+        "\n".join([
+            *(u.key for u in uploads), target_country, target_audience,
+            MODEL, SYSTEM_INSTRUCTION
+        ]).encode()
+    ).hexdigest()
+
+# --- 生成 Listing：上传图片、拼装提示词并发起流式调用，返回文本流 ---
+# uploads 中每项需有 bytes 和 key（内容哈希）两个属性
+def generate_listing(api_key, uploads, target_country, target_audience,
+                     on_retry=None):
+    client = get_client(api_key)
+
+    # 创建一个列表，用来存放所有的内容部分（图片+文字）
+    content_parts = []
+
+    # 1. 并发上传所有图片，再按原顺序加入到请求中
+    def upload(u):
+        data, mime_type = normalize_image(u.key, u.bytes)
+        return upload_image(api_key, u.key, data, mime_type), mime_type
+
+    with ThreadPoolExecutor(max_workers=min(8, len(uploads))) as executor:
+        uploaded = list(executor.map(upload, uploads))
+
+    for file_uri, mime_type in uploaded:
+        content_parts.append(
+            types.Part.from_uri(file_uri=file_uri, mime_type=mime_type)
+        )
+
+    # 2. 加入提示词
+    user_prompt = f"""
+    这是我的产品图片（共 {len(uploads)} 张，展示了不同角度/细节）。
+    目标站点：【{target_country}】
+    目标受众：【{target_audience if target_audience else "通用受众"}】
+
+    请严格按照 System Instruction 的流程进行：
+    1. 视觉诊断 (综合分析所有图片细节)
+    2. 联网搜索痛点 (必须使用 Google Search)
+    3. 撰写 Listing
+    """
+    content_parts.append(types.Part.from_text(text=user_prompt))
+
+    # 3. 调用模型
+    contents = [
+        types.Content(
+            role="user",
+            parts=content_parts # 这里放入了多张图片+文字
+        )
+    ]
+    return stream_text(
+        stream_chunks(client, contents, GENERATE_CONFIG, on_retry=on_retry)
+    )